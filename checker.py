@@ -0,0 +1,139 @@
+from error import error
+from my_ast import Unit, Node
+import error as error_module
+
+# argument types and result of every instruction that goes through expect_only_types
+# a str result is the type returned, an int is the index of the argument that gets returned, None is not known
+signatures: dict[str, tuple[list[str], str | int | None]] = {
+    "$inline": (["unit"], "unit"),
+    "$define": (["unit"], "unit"),
+    "$print": (["any"], 0),
+    "$get": (["unit"], None),
+    "$set!": (["unit", "any"], 1),
+    "$globaldefine": (["unit"], "unit"),
+    "$globalset!": (["unit", "any"], 1),
+    "$globalget": (["unit"], None),
+    "$number": (["unit"], "number"),
+    "$len": (["list"], "number"),
+    "$index": (["list", "number"], None),
+    "$push!": (["list", "any"], 1),
+    "$pop!": (["list"], None),
+    "$insert!": (["list", "number", "any"], 2),
+    "$delete!": (["list", "number"], None),
+    "$type": (["any"], "unit"),
+    "$free": (["unit"], None),
+    "$globalfree": (["unit"], None),
+    "$unit": (["any"], "unit"),
+    "$exit": (["number"], None),
+    "$strget": (["unit", "number"], "unit"),
+    "$strpush!": (["unit", "unit"], "unit"),
+    "$strset!": (["unit", "unit", "number"], "unit"),
+    "$round": (["number"], "number"),
+    "$peephole": (["unit", "list", "list"], "unit"),
+    "$pmap": (["func", "list"], "list"),
+}
+
+for op in ["$+", "$-", "$*", "$/", "$%", "$&", "$|", "$^", "$==", "$!=", "$>", "$<", "$>=", "$<="]:
+    signatures[op] = (["number", "number"], "number")
+
+def check_form(node: Node | Unit) -> None:
+    # static errors belong to the top level form, not to whatever the last form was running
+    errors, pre = error_module.errors, error_module.current_pre
+    error_module.errors, error_module.current_pre = [], "<main>"
+
+    try:
+        check(node)
+    finally:
+        error_module.errors, error_module.current_pre = errors, pre
+
+def check_all(nodes: list[Node | Unit]) -> list[str | None]:
+    return [check(x) for x in nodes]
+
+def check(node: Node | Unit) -> str | None:
+    # returns the type node always compiles to (or None if not known) and reports mismatches before running anything
+    # call sites where every argument is proven to have the right type are marked as checked
+    if type(node) == Unit:
+        return "unit"
+
+    if len(node) == 0:
+        return "nil"
+
+    if type(node[0]) != Unit:
+        return None
+
+    func = node[0].value
+
+    if func in signatures:
+        types, result = signatures[func]
+        found = check_all(node.children[1:])
+
+        if len(found) != len(types):
+            error(node, f"instruction {func} doesnt have expected argument length of {len(types)}", f"encountered {len(found)}")
+
+        for i, (item, t) in enumerate(zip(found, types)):
+            if item != None and item != t and t != "any":
+                error(node, f"mismatching types for instruction {func}", f"expected {t} on argument {i} but found {item}")
+
+        node.checked = all(item == t or t == "any" for item, t in zip(found, types))
+
+        if type(result) == int:
+            return found[result]
+        return result
+
+    match func:
+        case "$lambda":
+            if len(node) >= 3:
+                check(node[2])
+
+            return "func"
+
+        case "$if":
+            if len(node) != 4:
+                return None
+
+            cond, true, false = check_all(node.children[1:])
+
+            if cond != None and cond != "number":
+                error(node, f"mismatching types in instruction $if", f"expected number, found {cond}")
+
+            return true if true == false else None
+
+        case "$&&" | "$||":
+            if len(node) != 3:
+                return None
+
+            cond1, cond2 = check_all(node.children[1:])
+
+            if cond1 != None and cond1 != "number":
+                error(node, f"mismatching types for instruction {func}", f"expected number on argument 0 but found {cond1}")
+
+            return "number" if cond2 == "number" else None
+
+        case "$while!" | "$dowhile!":
+            found = check_all(node.children[1:])
+
+            if len(found) >= 1 and found[0] != None and found[0] != "number":
+                error(node, f"mismatching type for instruction {func}", f"expected number on argument 0 but got {found[0]}")
+
+            return "list"
+
+        case "$begin":
+            if len(node) == 1:
+                return None
+
+            return check_all(node.children[1:])[-1]
+
+        case "$quote":
+            if len(node) != 2:
+                return None
+
+            return "unit" if type(node[1]) == Unit else "list"
+
+        case "$nil":
+            return "nil" if len(node) == 1 else None
+
+        case "$macro":
+            return "str"
+
+        case _: # macros, functions and the rest, their arguments might not be code
+            return None
@@ -1,12 +1,23 @@
-from error import error, special_error, append_error_element, change_pre
-from copy import deepcopy as copy
+from error import error, special_error, append_error_element, pop_error_element, change_pre
 from my_ast import Unit, Node
 from emitter import emit
 from typing import Any
+from functools import partial
 from lark import Token
+import multiprocessing
+import error as error_module
+import peephole
+import limits
+import sys
 
-scope: list[dict[str, "Value"]] = [{}] # scope[0] is the global scope
 macros: dict[str, "Macro"] = {} # global and local macros?
+countdown = 1 # instructions left until limits.check
+depth = 0 # number of function calls being run
+expansions = 0 # number of macro expansions, for --mem-report
+pool = None # worker processes for $pmap, made on first use
+
+# instructions that cant run in a $pmap worker, since their effects wouldnt reach the main process
+impure_instructions = ["$inline", "$print", "$exit", "$globalget", "$globalset!", "$globaldefine", "$globalfree", "$macro", "$quotemacro", "$peephole"]
 
 class Value:
     builtins = ["unit", "list", "number", "func", "nil"]
@@ -35,67 +46,123 @@ class Value:
             case _:
                 special_error(f"cannot convert Value to str")
 
+class Frame:
+    def __init__(self, vars: dict[str, Value], parent: "Frame | None") -> None:
+        self.vars = vars
+        self.parent = parent # frame the function was made in, None for the global frame
+
+    def find(self, name: str) -> "Frame | None": # only walks the frames the code was written in, not the whole call stack
+        frame = self
+
+        while frame != None:
+            if name in frame.vars:
+                return frame
+
+            frame = frame.parent
+
+        return None
+
+    def __reduce__(self) -> tuple:
+        if self.parent == None: # functions being pickled ($pmap, images) refer to the global frame of the process loading them
+            return (get_global_frame, ())
+
+        return (Frame, (self.vars, self.parent))
+
+def get_global_frame() -> Frame:
+    return global_frame
+
+global_frame = Frame({}, None)
+frame = global_frame # frame of the code being run
+
 class Func:
-    def __init__(self, args: list[str], code: Node) -> None:
+    def __init__(self, args: list[str], code: Node, env: Frame) -> None:
         self.args = args
         self.code = code
+        self.env = env # frame the function was made in
 
 class Macro:
     def __init__(self, syntax: list[tuple[list[str], Node]]) -> None:
         self.syntax = syntax
+        self.plans = [] # (argument names, vararg, check length, plan) for every syntax, worked out once here
+
+        for args, code in syntax:
+            if type(code) == Node:
+                code.make_synthetic()
+
+            vararg = len(args) >= 1 and len(args[-1]) >= 4 and args[-1][-3:] == "..."
+            if vararg:
+                args = args[:-1] + [args[-1][:-3]]
+
+            check_len = not (len(args) >= 1 and len(args[-1]) >= 3 and args[-1][-3:] == "...")
 
-    def replace(self, node: Node, table: dict[str, str]) -> Node:
-        new = Node([])
+            self.plans.append((args, vararg, check_len, self.plan(code, args) if type(code) == Node else []))
 
-        for x in node:
+    def plan(self, node: Node, args: list[str]) -> list[tuple[int, Any]]:
+        # every (index, plan) in node that leads to an argument, a str plan is the argument itself
+        plan = []
+
+        for i, x in enumerate(node):
             if type(x) == Unit:
-                if x.value in table:
-                    new.append(table[x.value])
-                else:
-                    new.append(Unit(None, x.value))
+                if x.value in args:
+                    plan.append((i, x.value))
             else: # type(x) == Node:
-                new.append(self.replace(x, table))
+                if (sub := self.plan(x, args)) != []:
+                    plan.append((i, sub))
 
-        return new
+        return plan
 
-    def change_source(self, args: list[Unit | Node]) -> list[Unit | Node]:
-        new = []
+    def replace(self, node: Node | Unit, plan: list[tuple[int, Any]], table: dict[str, Unit | Node]) -> Node | Unit:
+        # only nodes leading to an argument are copied, everything else is shared with the template
+        if type(node) == Unit: # the whole body is a single unit
+            return table.get(node.value, node)
+
+        children = list(node.children)
+
+        for i, p in plan:
+            if type(p) == str:
+                children[i] = table[p]
+            else:
+                children[i] = self.replace(node[i], p, table)
 
+        return Node(children, synthetic = True)
+
+    def change_source(self, args: list[Unit | Node]) -> list[Unit | Node]:
         for x in args:
-            if type(x) == Unit:
-                new.append(Unit(None, x.value))
-            else: # type(x) == Node:
-                new.append(Node(self.change_source(x.children)))
+            if type(x) == Node:
+                x.make_synthetic()
 
-        return new
+        return args
 
     def macro_replace(self, node: Node, args: list[Unit | Node], name: str) -> Node:
-        for s in self.syntax:
-            s_args = copy(s[0])
-            s_code = s[1]
+        global expansions
 
-            if len(s_args) >= 1 and len(s_args[-1]) >= 4 and s_args[-1][-3:] == "...":
-                s_args[-1] = s_args[-1][:-3]
+        for s, (s_args, vararg, check_len, plan) in zip(self.syntax, self.plans):
+            s_code = s[1]
 
+            if vararg:
                 i = len(s_args) - 1
-                new_args = args[:i]
+                new_args = list(args[:i])
                 new_args.append(Node([
                     Unit(None, "$quote"),
-                    Node(args[i:])
-                ]))
+                    Node(args[i:], synthetic = True)
+                ], synthetic = True))
                 args = new_args
 
-            if not (len(s_args) >= 1 and len(s_args[-1]) >= 3 and s_args[-1][-3:] == "..."):
+            if check_len:
                 if len(args) != len(s_args):
                     continue
             # => len is correct
 
-            append_error_element(node, change_pre(f"<macro {name}>"))
-            return self.replace(s_code, {s_arg: val for s_arg, val in zip(s_args, self.change_source(args))})
+            expansions += 1
+
+            return self.replace(s_code, plan, {s_arg: val for s_arg, val in zip(s_args, self.change_source(args))})
 
         error(node, f"no syntax was satisfied for macro", f"encountered an argument length of {len(args)}")
 
 def expect_only_types(node: Node, args: list[Value], types: list[str]) -> None:
+    if node.checked: # already proven by checker.py
+        return
+
     size = len(types)
 
     if len(args) != size:
@@ -130,18 +197,18 @@ def quasiquote(x: Node | Unit) -> Value:
         else:
             return Value("list", [quasiquote(y) for y in x])
 
-def free(node: Node, scope_index: int, name: str) -> Value:
-    ifglobal = "global " if scope_index == 0 else ""
+def free(node: Node, frame: Frame, name: str, is_global: bool = False) -> Value:
+    ifglobal = "global " if is_global else ""
 
-    if name not in scope[scope_index]:
+    if name not in frame.vars:
         error(node, f"tried to {ifglobal}free an unknown variable", f"{ifglobal}variable {name} doesnt exist")
 
-    return scope[scope_index].pop(name)
+    return frame.vars.pop(name)
 
-def define(node: Node, scope_index: int, name: str) -> Value:
-    ifglobal = "global " if scope_index == 0 else ""
+def define(node: Node, frame: Frame, name: str, is_global: bool = False) -> Value:
+    ifglobal = "global " if is_global else ""
 
-    if name in scope[scope_index]:
+    if name in frame.vars:
         error(node, f"tried to {ifglobal}define a variable that already exists", f"{ifglobal}variable {name} already exists")
 
     if len(name) >= 1 and name[0] == "$":
@@ -150,25 +217,138 @@ def define(node: Node, scope_index: int, name: str) -> Value:
     if name in macros:
         error(node, f"trying to define a variable with the same name as a marco", f"{name} is already reserved for a macro")
 
-    scope[scope_index][name] = Value("nil", None)
+    frame.vars[name] = Value("nil", None)
     return Value("unit", name)
 
-def set(node: Node, scope_index: int, name: str, value: Value) -> Value:
-    ifglobal = "global " if scope_index == 0 else ""
+def set(node: Node, frame: Frame, name: str, value: Value, is_global: bool = False) -> Value:
+    ifglobal = "global " if is_global else ""
 
-    if name not in scope[scope_index]:
+    if (found := frame.find(name)) == None:
         error(node, f"tried to {ifglobal}set an unknown variable", f"{ifglobal}variable {name} doesnt exist")
 
-    scope[scope_index][name] = value
+    found.vars[name] = value
     return value
 
-def get(node: Node, scope_index: int, name: str) -> Value:
-    ifglobal = "global " if scope_index == 0 else ""
+def get(node: Node, frame: Frame, name: str, is_global: bool = False) -> Value:
+    ifglobal = "global " if is_global else ""
 
-    if name not in scope[scope_index]:
+    if (found := frame.find(name)) == None:
         error(node, f"tried to {ifglobal}get an unknown variable", f"{ifglobal}variable {name} doesnt exist")
 
-    return scope[scope_index][name]
+    return found.vars[name]
+
+def bound(node: Node | Unit) -> list[str]: # names a function body defines in its own frames
+    if type(node) == Unit:
+        return []
+
+    names = []
+
+    if len(node) >= 2 and type(node[0]) == Unit:
+        if node[0].value == "$define" and type(node[1]) == Unit:
+            names.append(node[1].value)
+        elif node[0].value == "$lambda" and type(node[1]) == Node:
+            names += [x.value for x in node[1] if type(x) == Unit]
+
+    for x in node:
+        names += bound(x)
+
+    return names
+
+def impure(node: Node | Unit, names: list[str]) -> str | None: # returns what stops the code from running in a $pmap worker
+    if type(node) == Unit:
+        return node.value if node.value in impure_instructions else None
+
+    # names of the function's own frames shadow globals
+    if len(node) >= 1 and type(node[0]) == Unit and node[0].value not in names and (node[0].value in global_frame.vars or node[0].value in macros):
+        return node[0].value
+
+    if len(node) >= 2 and type(node[0]) == Unit and node[0].value in ["$get", "$set!"] and type(node[1]) == Unit and node[1].value not in names and node[1].value in global_frame.vars:
+        return node[1].value
+
+    # changes to captured variables would only happen in the worker
+    if len(node) >= 2 and type(node[0]) == Unit and node[0].value in ["$set!", "$free"]:
+        if type(node[1]) == Node:
+            if not (len(node[1]) == 2 and type(node[1][0]) == Unit and node[1][0].value == "$define"): # ($set! ($define x) ...) is in its own frame
+                return f"{node[0].value} of a variable whose name isnt known ahead of time"
+        elif node[1].value not in names:
+            return f"{node[0].value} of captured variable {node[1].value}"
+
+    for x in node:
+        if (found := impure(x, names)) != None:
+            return found
+
+    return None
+
+def impure_value(value: Value, seen: dict[int, bool]) -> str | None: # seen stops functions that capture themselves
+    if id(value) in seen:
+        return None
+    seen[id(value)] = True
+
+    match value.type:
+        case "func":
+            f = value.value
+
+            if (found := impure(f.code, f.args + bound(f.code))) != None:
+                return found
+
+            env = f.env
+            while env != global_frame: # frames the function closes over
+                for x in env.vars.values():
+                    if (found := impure_value(x, seen)) != None:
+                        return found
+                env = env.parent
+
+        case "list":
+            for x in value.value:
+                if (found := impure_value(x, seen)) != None:
+                    return found
+
+    return None
+
+def executed() -> int: # instructions run so far, including the ones still counted down
+    return limits.executed + limits.pending - countdown
+
+def pmap_item(node: Node, f: Value, base: int, item: Value) -> tuple[int, Value | None, int]: # runs in a worker
+    global frame, depth, countdown
+
+    old_frame, old_depth, errors, pre = frame, depth, len(error_module.errors), error_module.current_pre
+
+    # the limits start from what the main process had run, the main process adds what every item ran
+    limits.executed, limits.pending, countdown = base, 1, 1
+
+    try:
+        value = call(node, f, [item])
+        return 0, value, executed() - base
+    except SystemExit as e: # an error was already printed, the main process exits with the same code
+        sys.stdout.flush()
+        return e.code if type(e.code) == int else 1, None, 0
+    finally: # workers are reused for other items
+        frame, depth = old_frame, old_depth
+        del error_module.errors[errors:]
+        error_module.current_pre = pre
+
+def pmap(node: Node, f: Value, items: list[Value]) -> list[Value]:
+    global pool, countdown
+
+    if "fork" not in multiprocessing.get_all_start_methods(): # workers need the state of this process
+        return [call(node, f, [x]) for x in items]
+
+    if pool == None:
+        sys.stdout.flush() # otherwise the workers print it again
+        pool = multiprocessing.get_context("fork").Pool()
+
+    results = []
+
+    for code, x, count in pool.map(partial(pmap_item, node, f, executed()), items):
+        if code != 0:
+            exit(code)
+
+        results.append(x)
+        limits.executed += count
+
+    countdown = limits.check(node, countdown)
+
+    return results
 
 def call(node: Node, f: Value, args: list[Value]) -> Value:
     if f.type != "func":
@@ -177,435 +357,484 @@ def call(node: Node, f: Value, args: list[Value]) -> Value:
     if len(f.value.args) != len(args):
         error(node, f"argument length doesnt match when calling a function") # todo kargs and kwargs
 
-    scope.append({x: args[i] for i, x in enumerate(f.value.args)})
+    global frame, depth
+
+    limits.check_depth(node, depth + 1)
+
+    old = frame
+    frame = Frame({x: args[i] for i, x in enumerate(f.value.args)}, f.value.env)
+    depth += 1
 
     append_error_element(node, change_pre("<function>"))
 
-    x = compile(f.value.code)
-    scope.pop()
-    return x
+    try:
+        return compile(f.value.code)
+    except RecursionError as e: # python ran out of frames, reported from the outermost call where theres room to print
+        if not hasattr(e, "node"):
+            e.node = node
+
+        if depth == 1:
+            error(e.node, f"call depth limit reached", f"calls nested deeper than python allows", notes=["use --max-depth to allow deeper calls"], exit_code = limits.EXIT_CODE)
+
+        raise
+    finally:
+        frame = old
+        depth -= 1
+        pop_error_element()
 
 def compile(node: Node | Unit) -> Value:
+    global countdown
+
     if type(node) == Node:
-        if node.main:
-            for child in node:
-                compile(child)
+        countdown -= 1
+        if countdown == 0:
+            countdown = limits.check(node)
 
-            return Value("nil", None)
-        else:
-            if len(node) == 0:
-                return Value("nil", None) #? nil or empty node?
+        if len(node) == 0:
+            return Value("nil", None) #? nil or empty node?
 
-            if type(node[0]) != Unit:
-                special_error(f"calling a node and not a unit: {node[0]}")
+        if type(node[0]) != Unit:
+            special_error(f"calling a node and not a unit: {node[0]}")
 
-            func = node[0].value
+        func = node[0].value
 
-            if func in ["$inline", "$define", "$print", "$get", "$set!",  "$number", "$len", "$index", "$push!", "$pop!", "$insert!", "$delete!", "$type", "$nil", "$+", "$-", "$*", "$/", "$%", "$&", "$|", "$^", "$round", "$==", "$!=", "$>", "$<", "$>=", "$<=", "$free", "$unit", "$exit", "$globalget", "$globalset!", "$globalfree", "$globaldefine", "$call", "$strget", "$strpush!", "$strset!"]:
-                args = [compile(x) for x in node.children[1:]]
-            else:
-                args = []
+        if func in ["$inline", "$define", "$print", "$get", "$set!",  "$number", "$len", "$index", "$push!", "$pop!", "$insert!", "$delete!", "$type", "$nil", "$+", "$-", "$*", "$/", "$%", "$&", "$|", "$^", "$round", "$==", "$!=", "$>", "$<", "$>=", "$<=", "$free", "$unit", "$exit", "$globalget", "$globalset!", "$globalfree", "$globaldefine", "$call", "$strget", "$strpush!", "$strset!", "$peephole", "$pmap"]:
+            args = [compile(x) for x in node.children[1:]]
+        else:
+            args = []
 
-            match func:
-                case "$inline": # $inline code!
-                    expect_only_types(node, args, ["unit"])
+        match func:
+            case "$inline": # $inline code!
+                expect_only_types(node, args, ["unit"])
 
-                    emit(args[0].value + "\n")
-                    return Value("unit", args[0])
+                emit(args[0].value + "\n")
+                return Value("unit", args[0])
 
-                case "$define": # $define var!
-                    expect_only_types(node, args, ["unit"])
+            case "$define": # $define var!
+                expect_only_types(node, args, ["unit"])
 
-                    return define(node, -1, args[0].value)
+                return define(node, frame, args[0].value)
 
-                case "$print": # $print var
-                    expect_only_types(node, args, ["any"])
+            case "$print": # $print var
+                expect_only_types(node, args, ["any"])
 
-                    print(args[0])
-                    return args[0]
+                print(args[0])
+                return args[0]
 
-                case "$get": # $get var!
-                    expect_only_types(node, args, ["unit"])
+            case "$get": # $get var!
+                expect_only_types(node, args, ["unit"])
 
-                    return get(node, -1, args[0].value)
+                return get(node, frame, args[0].value)
 
-                case "$set!": # $set! var! value
-                    expect_only_types(node, args, ["unit", "any"])
+            case "$set!": # $set! var! value
+                expect_only_types(node, args, ["unit", "any"])
 
-                    return set(node, -1, args[0].value, args[1])
+                return set(node, frame, args[0].value, args[1])
 
-                case "$globaldefine": # $globaldefine var!
-                    expect_only_types(node, args, ["unit"])
+            case "$globaldefine": # $globaldefine var!
+                expect_only_types(node, args, ["unit"])
 
-                    return define(node, 0, args[0].value)
+                return define(node, global_frame, args[0].value, is_global = True)
 
-                case "$globalset!": # $globalset! var! value
-                    expect_only_types(node, args, ["unit", "any"])
+            case "$globalset!": # $globalset! var! value
+                expect_only_types(node, args, ["unit", "any"])
 
-                    return set(node, 0, args[0].value, args[1])
+                return set(node, global_frame, args[0].value, args[1], is_global = True)
 
-                case "$globalget": # $globalget var!
-                    expect_only_types(node, args, ["unit"])
+            case "$globalget": # $globalget var!
+                expect_only_types(node, args, ["unit"])
 
-                    return get(node, 0, args[0].value)
+                return get(node, global_frame, args[0].value, is_global = True)
 
-                case "$lambda": # $lambda args% code%
-                    # type check
-                    for i in range(1):
-                        if type(node[i + 1]) != Node:
-                            error(node, f"mismatching types for instruction $lambda", f"expected a node on argument {i}, got a unit instead")
+            case "$lambda": # $lambda args% code%
+                # type check
+                for i in range(1):
+                    if type(node[i + 1]) != Node:
+                        error(node, f"mismatching types for instruction $lambda", f"expected a node on argument {i}, got a unit instead")
 
-                    for x in node[1]:
-                        if type(x) != Unit:
-                            error(node, f"mismatching types for instruction $lambda", f"expected argument 1 to be all units, found node instead")
-                    
-                    f = Func([x.value for x in node[1]], node[2])
+                for x in node[1]:
+                    if type(x) != Unit:
+                        error(node, f"mismatching types for instruction $lambda", f"expected argument 1 to be all units, found node instead")
+                
+                f = Func([x.value for x in node[1]], node[2], frame)
 
-                    return Value("func", f)
+                return Value("func", f)
 
-                case "$if": # $if cond% true% false%
-                    # type check
-                    if len(node) != 4:
-                        error(node, f"incorrect length of arguments for instruction $if", f"expected 3, found {len(node) - 1}")
+            case "$if": # $if cond% true% false%
+                # type check
+                if len(node) != 4:
+                    error(node, f"incorrect length of arguments for instruction $if", f"expected 3, found {len(node) - 1}")
 
-                    for i, x in enumerate([node[2], node[3]]):
-                        if type(x) != Node:
-                            error(node, f"mismatching types in instruction $if", f"expected node on argument {i + 1}, found unit instead")
+                for i, x in enumerate([node[2], node[3]]):
+                    if type(x) != Node:
+                        error(node, f"mismatching types in instruction $if", f"expected node on argument {i + 1}, found unit instead")
 
-                    cond = compile(node[1])
-                    
-                    if cond.type != "number":
-                        error(node, f"mismatching types in instruction $if", f"expected number, found {cond.type}")
+                cond = compile(node[1])
+                
+                if cond.type != "number":
+                    error(node, f"mismatching types in instruction $if", f"expected number, found {cond.type}")
+
+                if cond.value != 0: # condition passed
+                    return compile(node[2])
+                else: # condition didnt pass
+                    return compile(node[3])
+
+            case "$&&": # $&& cond1 cond2
+                # type check
+                if len(node) != 3:
+                    error(node, f"incorrect length of arguments for instruction $&&", f"expected 2 but found {len(node) - 1}")
 
-                    if cond.value != 0: # condition passed
-                        return compile(node[2])
-                    else: # condition didnt pass
-                        return compile(node[3])
+                cond1 = compile(node[1])
 
-                case "$&&": # $&& cond1 cond2
-                    # type check
-                    if len(node) != 3:
-                        error(node, f"incorrect length of arguments for instruction $&&", f"expected 2 but found {len(node) - 1}")
+                if cond1.type != "number":
+                    error(node, f"mismatching types for instruction $&&", f"expected number on argument 0 but found {cond1.type}")
 
-                    cond1 = compile(node[1])
+                if cond1.value != 0: # condition passed
+                    cond2 = compile(node[2])
 
                     if cond1.type != "number":
-                        error(node, f"mismatching types for instruction $&&", f"expected number on argument 0 but found {cond1.type}")
+                        error(node, f"mismatching types for instruction $&&", f"expected number on argument 1 but found {cond1.type}")
 
-                    if cond1.value != 0: # condition passed
-                        cond2 = compile(node[2])
+                    return cond2
+                else:
+                    return cond1 # dont compile the 2nd argument
 
-                        if cond1.type != "number":
-                            error(node, f"mismatching types for instruction $&&", f"expected number on argument 1 but found {cond1.type}")
+            case "$||": # $|| cond1 cond2
+                # type check
+                if len(node) != 3:
+                    error(node, f"incorrect length of arguments for instruction $||", f"expected 2 but found {len(node) - 1}")
 
-                        return cond2
-                    else:
-                        return cond1 # dont compile the 2nd argument
+                cond1 = compile(node[1])
 
-                case "$||": # $|| cond1 cond2
-                    # type check
-                    if len(node) != 3:
-                        error(node, f"incorrect length of arguments for instruction $||", f"expected 2 but found {len(node) - 1}")
+                if cond1.type != "number":
+                    error(node, f"mismatching types for instruction $||", f"expected number on argument 0 but found {cond1.type}")
 
-                    cond1 = compile(node[1])
+                if cond1.value != 0: # condition passed
+                    return cond1 # dont compile the 2nd argument
+                else:
+                    cond2 = compile(node[2])
 
                     if cond1.type != "number":
-                        error(node, f"mismatching types for instruction $||", f"expected number on argument 0 but found {cond1.type}")
+                        error(node, f"mismatching types for instruction $||", f"expected number on argument 1 but found {cond1.type}")
 
-                    if cond1.value != 0: # condition passed
-                        return cond1 # dont compile the 2nd argument
-                    else:
-                        cond2 = compile(node[2])
+                    return cond2
 
-                        if cond1.type != "number":
-                            error(node, f"mismatching types for instruction $||", f"expected number on argument 1 but found {cond1.type}")
+            case "$number": # $number unit!
+                expect_only_types(node, args, ["unit"])
 
-                        return cond2
+                try:
+                    x = float(args[0].value)
+                except:
+                    error(node, f"cannot convert unit to number")
+                if x.is_integer():
+                    x = int(x)
 
-                case "$number": # $number unit!
-                    expect_only_types(node, args, ["unit"])
+                return Value("number", x)
 
-                    try:
-                        x = float(args[0].value)
-                    except:
-                        error(node, f"cannot convert unit to number")
-                    if x.is_integer():
-                        x = int(x)
+            case "$quote": # $quote x
+                if len(node) != 2:
+                    error(node, f"invalid argument length for instruction $quote", f"expected 1, got {len(node)}")
 
-                    return Value("number", x)
+                return quote(node[1])
 
-                case "$quote": # $quote x
-                    if len(node) != 2:
-                        error(node, f"invalid argument length for instruction $quote", f"expected 1, got {len(node)}")
+            case "$quasiquote": # $quasiquote x
+                if len(node) != 2:
+                    error(node, f"invalid argument length for instruction $quasiquote", f"expected 1, got {len(node)}")
 
-                    return quote(node[1])
+                return quasiquote(node[1])
 
-                case "$quasiquote": # $quasiquote x
-                    if len(node) != 2:
-                        error(node, f"invalid argument length for instruction $quasiquote", f"expected 1, got {len(node)}")
+            case "$len": # $len list^
+                expect_only_types(node, args, ["list"])
 
-                    return quasiquote(node[1])
+                return Value("number", len(args[0].value))
+    
+            case "$index": # $index list^ i*
+                expect_only_types(node, args, ["list", "number"])
 
-                case "$len": # $len list^
-                    expect_only_types(node, args, ["list"])
+                if args[1].value >= len(args[0].value):
+                    error(node, f"index out of range", f"expected a value between 0 and {len(args[0].value)}, but got {args[1].value}")
 
-                    return Value("number", len(args[0].value))
-        
-                case "$index": # $index list^ i*
-                    expect_only_types(node, args, ["list", "number"])
+                return args[0].value[args[1].value]
 
-                    if args[1].value >= len(args[0].value):
-                        error(node, f"index out of range", f"expected a value between 0 and {len(args[0].value)}, but got {args[1].value}")
+            case "$push!": # $push! list^ x
+                expect_only_types(node, args, ["list", "any"])
 
-                    return args[0].value[args[1].value]
+                args[0].value.append(args[1])
 
-                case "$push!": # $push! list^ x
-                    expect_only_types(node, args, ["list", "any"])
+                return args[1]
 
-                    args[0].value.append(args[1])
+            case "$pop!": # $pop! list^
+                expect_only_types(node, args, ["list"])
 
-                    return args[1]
+                if len(args[0].value) == 0:
+                    error(node, f"cant pop from an empty list")
 
-                case "$pop!": # $pop! list^
-                    expect_only_types(node, args, ["list"])
+                return args[0].value.pop()
 
-                    if len(args[0].value) == 0:
-                        error(node, f"cant pop from an empty list")
+            case "$insert!": # $insert! list^ index* value
+                expect_only_types(node, args, ["list", "number", "any"])
 
-                    return args[0].value.pop()
+                if args[1].value < 0 or args[1].value > len(args[0].value) or type(args[1].value) != int:
+                    error(node, f"index out of range", f"mr ember says {args[1].value} is not in range")
 
-                case "$insert!": # $insert! list^ index* value
-                    expect_only_types(node, args, ["list", "number", "any"])
+                args[0].value.insert(args[1].value, args[2])
 
-                    if args[1].value < 0 or args[1].value > len(args[0].value) or type(args[1].value) != int:
-                        error(node, f"index out of range", f"mr ember says {args[1].value} is not in range")
+                return args[2]
 
-                    args[0].value.insert(args[1].value, args[2])
+            case "$delete!": # $delete! list^ index*
+                expect_only_types(node, args, ["list", "number"])
 
-                    return args[2]
+                if args[1].value < 0 or args[1].value >= len(args[0].value) or type(args[1].value) != int:
+                    error(node, f"index out of range", f"mr ember says {args[1].value} is not in range")
 
-                case "$delete!": # $delete! list^ index*
-                    expect_only_types(node, args, ["list", "number"])
+                return args[0].value.pop(args[1].value)
 
-                    if args[1].value < 0 or args[1].value >= len(args[0].value) or type(args[1].value) != int:
-                        error(node, f"index out of range", f"mr ember says {args[1].value} is not in range")
+            case "$while!": # $while! cond% code%
+                for i in range(1):
+                    if type(node[i + 1]) != Node:
+                        error(node, f"mismatching types for instruction $while!", f"expected a node on argument {i}, got a unit instead")
 
-                    return args[0].value.pop(args[1].value)
+                ret = Value("list", [])
 
-                case "$while!": # $while! cond% code%
-                    for i in range(1):
-                        if type(node[i + 1]) != Node:
-                            error(node, f"mismatching types for instruction $while!", f"expected a node on argument {i}, got a unit instead")
+                while True:
+                    cond = compile(node[1])
+                    if cond.type != "number":
+                        error(node, f"mismatching type for instruction $while!", f"expected number on argument 0 but got {cond.type}")
+                    
+                    if cond.value == 0:
+                        break
+                    
+                    ret.value.append(compile(node[2]))
 
-                    ret = Value("list", [])
+                return ret
 
-                    while True:
-                        cond = compile(node[1])
-                        if cond.type != "number":
-                            error(node, f"mismatching type for instruction $while!", f"expected number on argument 0 but got {cond.type}")
-                        
-                        if cond.value == 0:
-                            break
-                        
-                        ret.value.append(compile(node[2]))
+            case "$dowhile!": # $dowhile! cond% code%
+                for i in range(1):
+                    if type(node[i + 1]) != Node:
+                        error(node, f"mismatching types for instruction $dowhile!", f"expected a node on argument {i}, got a unit instead")
 
-                    return ret
+                ret = Value("list", [])
 
-                case "$dowhile!": # $dowhile! cond% code%
-                    for i in range(1):
-                        if type(node[i + 1]) != Node:
-                            error(node, f"mismatching types for instruction $dowhile!", f"expected a node on argument {i}, got a unit instead")
+                while True:
+                    ret.value.append(compile(node[2]))
 
-                    ret = Value("list", [])
+                    cond = compile(node[1])
+                    if cond.type != "number":
+                        error(node, f"mismatching type for instruction $dowhile!", f"expected number on argument 0 but got {cond.type}")
+                    
+                    if cond.value == 0:
+                        break
 
-                    while True:
-                        ret.value.append(compile(node[2]))
+                return ret
 
-                        cond = compile(node[1])
-                        if cond.type != "number":
-                            error(node, f"mismatching type for instruction $dowhile!", f"expected number on argument 0 but got {cond.type}")
-                        
-                        if cond.value == 0:
-                            break
+            case "$begin": # $begin nodes...
+                if len(node) == 1:
+                    error(node, f"empty $begin")
 
-                    return ret
+                for x in node.children[:-1]:
+                    compile(x)
 
-                case "$begin": # $begin nodes...
-                    if len(node) == 1:
-                        error(node, f"empty $begin")
+                return compile(node[-1])
 
-                    for x in node.children[:-1]:
-                        compile(x)
+            case "$type": # $type x
+                expect_only_types(node, args, ["any"])
 
-                    return compile(node[-1])
+                return Value("unit", args[0].type)
 
-                case "$type": # $type x
-                    expect_only_types(node, args, ["any"])
+            case "$nil": # $nil
+                if len(args) != 0:
+                    error(node, f"invalid argument length for instruction $nil", f"expected 0, found {len(args)}")
 
-                    return Value("unit", args[0].type)
+                return Value("nil", None)
 
-                case "$nil": # $nil
-                    if len(args) != 0:
-                        error(node, f"invalid argument length for instruction $nil", f"expected 0, found {len(args)}")
+            case "$free": # $free x!
+                expect_only_types(node, args, ["unit"])
 
-                    return Value("nil", None)
+                return free(node, frame, args[0].value)
 
-                case "$free": # $free x!
-                    expect_only_types(node, args, ["unit"])
+            case "$globalfree": # $globalfree x!
+                expect_only_types(node, args, ["unit"])
 
-                    return free(node, -1, args[0].value)
+                return free(node, global_frame, args[0].value, is_global = True)
 
-                case "$globalfree": # $globalfree x!
-                    expect_only_types(node, args, ["unit"])
+            case "$unit": # $unit x
+                expect_only_types(node, args, ["any"])
 
-                    return free(node, 0, args[0].value)
+                return Value("unit", str(args[0]))
 
-                case "$unit": # $unit x
-                    expect_only_types(node, args, ["any"])
+            case "$exit": # $exit n*
+                expect_only_types(node, args, ["number"])
 
-                    return Value("unit", str(args[0]))
+                exit(args[0].value)
 
-                case "$exit": # $exit n*
-                    expect_only_types(node, args, ["number"])
+            case "$strget": # $strget unit! index*
+                expect_only_types(node, args, ["unit", "number"])
 
-                    exit(args[0].value)
+                if args[1].value >= len(args[0].value):
+                    error(node, f"string index out of range", f"expected a value between 0 and {len(args[0].value)}, but got {args[1].value}")
 
-                case "$strget": # $strget unit! index*
-                    expect_only_types(node, args, ["unit", "number"])
+                return Value("unit", args[0].value[args[1].value])
 
-                    if args[1].value >= len(args[0].value):
-                        error(node, f"string index out of range", f"expected a value between 0 and {len(args[0].value)}, but got {args[1].value}")
+            case "$strpush!": # $strpush! dest! source!
+                expect_only_types(node, args, ["unit", "unit"])
 
-                    return Value("unit", args[0].value[args[1].value])
+                args[0].value += args[1].value
+                return Value("unit", args[1].value)
 
-                case "$strpush!": # $strpush! dest! source!
-                    expect_only_types(node, args, ["unit", "unit"])
+            case "$strset!": # $strset! unit! value! index*
+                expect_only_types(node, args, ["unit", "unit", "number"])
 
-                    args[0].value += args[1].value
-                    return Value("unit", args[1].value)
+                n = args[2].value # todo not an int errors when indexing
+                args[0].value = args[0].value[:n] + args[1].value + args[0].value[(n + 1):]
+                return Value("unit", args[1].value)
 
-                case "$strset!": # $strset! unit! value! index*
-                    expect_only_types(node, args, ["unit", "unit", "number"])
+            case "$peephole": # $peephole name! match^ replace^
+                expect_only_types(node, args, ["unit", "list", "list"])
 
-                    n = args[2].value # todo not an int errors when indexing
-                    args[0].value = args[0].value[:n] + args[1].value + args[0].value[(n + 1):]
-                    return Value("unit", args[1].value)
+                if args[0].value in peephole.fired:
+                    error(node, f"tried to define a peephole rule that already exists", f"rule {args[0].value} already exists")
 
-                case "$macro": # $macro name! syntaxes...
-                    if len(node) < 3:
-                        error(node, f"invalid argument length for instruction $macro", f"expected 2 or more, found {len(node)} instead")
+                if len(args[1].value) == 0:
+                    error(node, f"invalid peephole rule", f"expected 1 or more lines to match")
 
-                    if type(node[1]) != Unit:
-                        error(node, f"mismatching types for instruction $macro", f"expected unit in argument 0 but found {type(node[1]).__name__}")
-                    for i in range(2, len(node)):
-                        if type(node[i]) != Node:
-                            error(node, f"mismatching types for instruction $macro", f"expected unit in argument {i} but found {type(node[i]).__name__}")
+                for i in [1, 2]:
+                    for x in args[i].value:
+                        if x.type != "unit":
+                            error(node, f"invalid peephole rule", f"expected only units on argument {i} but found {x.type}")
 
-                    keys = [i for s in [list(j.keys()) for j in scope] for i in s]
-                    if node[1].value in keys:
-                        error(f"trying to define a macro with the same name as a variable", f"variable {node[1].value} already exists")
+                peephole.pattern(args[0].value, [x.value for x in args[1].value], [x.value for x in args[2].value])
 
-                    syntax = []
+                return args[0]
 
-                    for i, s in enumerate(node.children[2:]):
-                        if type(s) != Node:
-                            error(node, f"invalid macro syntax in syntax {i}", f"expected a node")
-                        
-                        if len(s) != 2:
-                            error(node, f"invalid macro syntax in syntax {i}", f"expected a node of length 2 but found length of {len(s)} instead")
+            case "$macro": # $macro name! syntaxes...
+                if len(node) < 3:
+                    error(node, f"invalid argument length for instruction $macro", f"expected 2 or more, found {len(node)} instead")
 
-                        args = []
-                        args_node = s[0]
+                if type(node[1]) != Unit:
+                    error(node, f"mismatching types for instruction $macro", f"expected unit in argument 0 but found {type(node[1]).__name__}")
+                for i in range(2, len(node)):
+                    if type(node[i]) != Node:
+                        error(node, f"mismatching types for instruction $macro", f"expected unit in argument {i} but found {type(node[i]).__name__}")
 
-                        for j, arg in enumerate(args_node):
-                            if type(arg) != Unit:
-                                error(node, f"invalid argument in macro syntax {i}", f"expected unit in argument {j} but found {type(arg).__name__} instead")
+                if frame.find(node[1].value) != None:
+                    error(node, f"trying to define a macro with the same name as a variable", f"variable {node[1].value} already exists")
 
-                            args.append(arg.value)
+                syntax = []
 
-                        code = s[1]
+                for i, s in enumerate(node.children[2:]):
+                    if type(s) != Node:
+                        error(node, f"invalid macro syntax in syntax {i}", f"expected a node")
+                    
+                    if len(s) != 2:
+                        error(node, f"invalid macro syntax in syntax {i}", f"expected a node of length 2 but found length of {len(s)} instead")
 
-                        syntax.append((args, code))
+                    args = []
+                    args_node = s[0]
 
-                    macros[node[1].value] = Macro(syntax)
+                    for j, arg in enumerate(args_node):
+                        if type(arg) != Unit:
+                            error(node, f"invalid argument in macro syntax {i}", f"expected unit in argument {j} but found {type(arg).__name__} instead")
 
-                    return Value("str", node[1].value)
+                        args.append(arg.value)
 
-                case "$quotemacro": # $quotemacro name! args...
-                    if len(node) < 2:
-                        error(node, f"invalid argument length for instruction $quotemacro", f"expected 1 or more but got {len(node) - 1}")
+                    code = s[1]
 
-                    if type(node[1]) != Unit:
-                        error(node, f"mismatching types for instruction $quotemacro", f"expected unit on argument 0 but found {type(node[1])}")
+                    syntax.append((args, code))
 
-                    if (name := node[1].value) not in macros:
-                        error(node, f"tried to expand a macro that doesnt exist", f"{node[1].value} doesnt exist")
+                macros[node[1].value] = Macro(syntax)
 
-                    macro = macros[name]
+                return Value("str", node[1].value)
 
-                    replaced = macro.macro_replace(node, node.children[2:], name)
-
-                    return quote(replaced)
-
-                case "$call": # $call name! args...
-                    if len(args) < 1:
-                        error(node, f"invalid argument length for instruction $call", f"expected 1 or more but got {len(args)}")
-
-                    if args[0].type != "func":
-                        error(node, f"mismatching types for instruction $call", f"expected func on argument 0 but found {args[0].type}")
-
-                    return call(node, args[0], args[1:])
-
-                case "$+": # $+ a* b*
-                    return num_op(node, args, lambda x, y: x + y)
-                case "$-": # $- a* b*
-                    return num_op(node, args, lambda x, y: x - y)
-                case "$*": # $* a* b*
-                    return num_op(node, args, lambda x, y: x * y)
-                case "$/": # $/ a* b*
-                    return num_op(node, args, lambda x, y: x / y)
-                case "$%": # $% a* b*
-                    return num_op(node, args, lambda x, y: x % y)
-                case "$&": # $& a* b*
-                    return num_op(node, args, lambda x, y: x & y)
-                case "$|": # $| a* b*
-                    return num_op(node, args, lambda x, y: x | y)
-                case "$^": # $^ a* b*
-                    return num_op(node, args, lambda x, y: x ^ y)
-                
-                case "$round": # $round x*
-                    expect_only_types(node, args, ["number"])
+            case "$quotemacro": # $quotemacro name! args...
+                if len(node) < 2:
+                    error(node, f"invalid argument length for instruction $quotemacro", f"expected 1 or more but got {len(node) - 1}")
+
+                if type(node[1]) != Unit:
+                    error(node, f"mismatching types for instruction $quotemacro", f"expected unit on argument 0 but found {type(node[1])}")
+
+                if (name := node[1].value) not in macros:
+                    error(node, f"tried to expand a macro that doesnt exist", f"{node[1].value} doesnt exist")
+
+                macro = macros[name]
+
+                replaced = macro.macro_replace(node, node.children[2:], name)
+
+                return quote(replaced)
 
-                    return Value("number", int(args[0].value))
+            case "$call": # $call name! args...
+                if len(args) < 1:
+                    error(node, f"invalid argument length for instruction $call", f"expected 1 or more but got {len(args)}")
 
-                case "$==": # $== a* b*
-                    return num_op(node, args, lambda x, y: (1 if x == y else 0))
-                case "$!=": # $!= a* b*
-                    return num_op(node, args, lambda x, y: (1 if x != y else 0))
-                case "$>": # $> a* b*
-                    return num_op(node, args, lambda x, y: (1 if x > y else 0))
-                case "$<": # $< a* b*
-                    return num_op(node, args, lambda x, y: (1 if x < y else 0))
-                case "$>=": # $>= a* b*
-                    return num_op(node, args, lambda x, y: (1 if x >= y else 0))
-                case "$<=": # $<= a* b*
-                    return num_op(node, args, lambda x, y: (1 if x <= y else 0))
+                if args[0].type != "func":
+                    error(node, f"mismatching types for instruction $call", f"expected func on argument 0 but found {args[0].type}")
 
-                case name:
-                    if (name in scope[(scope_index := -1)]) or (name in scope[(scope_index := 0)]): # try call a function
-                        args = [compile(x) for x in node.children[1:]]
+                return call(node, args[0], args[1:])
 
-                        f = scope[scope_index][name]
+            case "$pmap": # $pmap func^ list^
+                expect_only_types(node, args, ["func", "list"])
 
-                        return call(node, f, args)
-                    elif name in macros: # calling a macro
-                        macro = macros[name]
+                seen = {}
+                for x in [args[0]] + args[1].value:
+                    if (found := impure_value(x, seen)) != None:
+                        error(node, f"cannot run a function in parallel if it isnt pure", f"uses {found}", notes=["functions given to $pmap cant use $inline, $print, globals, macros or change captured variables"])
 
-                        replaced = macro.macro_replace(node, node.children[1:], name)
+                return Value("list", pmap(node, args[0], args[1].value))
 
+            case "$+": # $+ a* b*
+                return num_op(node, args, lambda x, y: x + y)
+            case "$-": # $- a* b*
+                return num_op(node, args, lambda x, y: x - y)
+            case "$*": # $* a* b*
+                return num_op(node, args, lambda x, y: x * y)
+            case "$/": # $/ a* b*
+                return num_op(node, args, lambda x, y: x / y)
+            case "$%": # $% a* b*
+                return num_op(node, args, lambda x, y: x % y)
+            case "$&": # $& a* b*
+                return num_op(node, args, lambda x, y: x & y)
+            case "$|": # $| a* b*
+                return num_op(node, args, lambda x, y: x | y)
+            case "$^": # $^ a* b*
+                return num_op(node, args, lambda x, y: x ^ y)
+            
+            case "$round": # $round x*
+                expect_only_types(node, args, ["number"])
+
+                return Value("number", int(args[0].value))
+
+            case "$==": # $== a* b*
+                return num_op(node, args, lambda x, y: (1 if x == y else 0))
+            case "$!=": # $!= a* b*
+                return num_op(node, args, lambda x, y: (1 if x != y else 0))
+            case "$>": # $> a* b*
+                return num_op(node, args, lambda x, y: (1 if x > y else 0))
+            case "$<": # $< a* b*
+                return num_op(node, args, lambda x, y: (1 if x < y else 0))
+            case "$>=": # $>= a* b*
+                return num_op(node, args, lambda x, y: (1 if x >= y else 0))
+            case "$<=": # $<= a* b*
+                return num_op(node, args, lambda x, y: (1 if x <= y else 0))
+
+            case name:
+                if (found := frame.find(name)) != None: # try call a function
+                    args = [compile(x) for x in node.children[1:]]
+
+                    f = found.vars[name]
+
+                    return call(node, f, args)
+                elif name in macros: # calling a macro
+                    macro = macros[name]
+
+                    replaced = macro.macro_replace(node, node.children[1:], name)
+
+                    append_error_element(node, change_pre(f"<macro {name}>"))
+
+                    try:
                         return compile(replaced)
+                    finally:
+                        pop_error_element()
 
-                    special_error(f"unknown function, instruction or macro {func}")
+                special_error(f"unknown function, instruction or macro {func}")
     else:
         assert type(node) == Unit
         return Value("unit", node.value)
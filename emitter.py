@@ -1,17 +1,28 @@
+import peephole
+import atexit
+
 file = None
 
 def init(file_name: str) -> None:
     global file
 
     file = open(file_name, "w")
+    atexit.register(exit) # $exit, errors and limits end the program without going through main.py
 
 def exit() -> None:
     global file
 
+    if file == None:
+        return
+
+    peephole.flush(file.write)
     file.close()
+    file = None
 
 def emit(string: str) -> None:
     if file == None:
         raise Exception("emitting but file isnt open")
+    elif len(peephole.rules) != 0:
+        peephole.emit(string, file.write)
     else:
         file.write(string)
@@ -1,7 +1,7 @@
 import my_ast as ast
 
 code_name = ""
-code = []
+line_offsets = [] # byte offset of the start of each line, filled in by reader.py
 current_pre = "<main>"
 
 class ErrorElement:
@@ -13,8 +13,8 @@ class ErrorElement:
 
     def print(self, pad: int, final: bool = False) -> None:
         line = " " * pad
-        if self.node[0].source != None:
-            token = self.node[0].source
+        if self.node.source() != None:
+            token = self.node.source()
             line = str(token.line)
             line = (" " * (pad - len(line))) + line
         else:
@@ -30,7 +30,7 @@ class ErrorElement:
             print(f"{str_pad} | ")
 
         if token != None:
-            print(f"{line} | {code[token.line - 1]}")
+            print(f"{line} | {get_line(token.line)}")
             if self.sec != "":
                 print(f"{str_pad} | {' ' * (token.column - 1)}{'^' * (token.end_column - token.column)} {self.sec}")
         else:
@@ -82,11 +82,21 @@ def append_error_element(node: ast.Node, pre: str, sec: str = "", notes: list[st
 
     errors.append(ErrorElement(node, pre, sec, notes))
 
-def init(_code_name: str, _code: list[str]) -> None: # todo multifile support
-    global code_name, code
+def pop_error_element() -> None: # undoes append_error_element once the call or macro it was for is done
+    global current_pre
+
+    current_pre = errors.pop().pre
+
+def init(_code_name: str, _line_offsets: list[int]) -> None: # todo multifile support
+    global code_name, line_offsets
 
     code_name = _code_name
-    code = _code
+    line_offsets = _line_offsets
+
+def get_line(number: int) -> str: # reads a single line of source on demand
+    with open(code_name, "rb") as file:
+        file.seek(line_offsets[number - 1])
+        return file.readline().decode().removesuffix("\n")
 
 def special_error(main: str, note: str = "", notes: list[str] = []) -> None: # todo figure out what to do with this
     if note != "":
@@ -97,14 +107,14 @@ def special_error(main: str, note: str = "", notes: list[str] = []) -> None: # t
         print(f"= {note}")
     exit(1)
 
-def error(node: ast.Node, main: str = "", sec: str = "", notes: list[str] = []) -> None:
+def error(node: ast.Node, main: str = "", sec: str = "", notes: list[str] = [], exit_code: int = 1) -> None:
     errors.append(ErrorElement(node, current_pre, sec, notes))
 
     # get pad
     pad = 0
     for err in errors:
-        if err.node[0].source != None:
-            l = len(str(err.node[0].source.line))
+        if err.node.source() != None:
+            l = len(str(err.node.source().line))
 
             pad = pad if pad >= l else l
 
@@ -113,7 +123,7 @@ def error(node: ast.Node, main: str = "", sec: str = "", notes: list[str] = [])
         if i == len(errors) - 1:
             print(f"ERROR: {main}")
             err.print(pad, final = True)
-            exit(1)
+            exit(exit_code)
         else:
             err.print(pad)
             print()
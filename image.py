@@ -0,0 +1,73 @@
+from error import special_error
+from my_ast import Unit, Node
+import compiler
+import hashlib
+import pickle
+
+# images hold the interpreter state (global frame and macros) so a prelude doesnt have to be run every time
+# the format is MAGIC, VERSION, the sha256 of the grammar and then the pickled state
+
+MAGIC = b"EMBERIMG"
+VERSION = 4
+
+def grammar_hash(grammar: str) -> bytes:
+    return hashlib.sha256(grammar.encode()).digest()
+
+def strip(x: Node | Unit) -> None:
+    # positions point at the prelude, not the file that will load the image, so theyre dropped
+    if type(x) == Unit:
+        x.position = None
+    else:
+        for y in x:
+            strip(y)
+
+def strip_value(value: "compiler.Value", seen: set[int]) -> None:
+    if id(value) in seen:
+        return
+    seen.add(id(value))
+
+    match value.type:
+        case "func":
+            strip(value.value.code)
+
+            env = value.value.env
+            while env != compiler.global_frame: # frames the function closes over
+                for x in env.vars.values():
+                    strip_value(x, seen)
+                env = env.parent
+
+        case "list":
+            for x in value.value:
+                strip_value(x, seen)
+
+def dump(file_name: str, grammar: str) -> None:
+    seen = set()
+
+    for value in compiler.global_frame.vars.values():
+        strip_value(value, seen)
+
+    for macro in compiler.macros.values():
+        for _, code in macro.syntax:
+            strip(code)
+
+    with open(file_name, "wb") as file:
+        file.write(MAGIC)
+        file.write(VERSION.to_bytes(4, "little"))
+        file.write(grammar_hash(grammar))
+        pickle.dump((compiler.global_frame.vars, compiler.macros), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load(file_name: str, grammar: str) -> None:
+    with open(file_name, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            special_error(f"{file_name} is not an ember image")
+
+        if (version := int.from_bytes(file.read(4), "little")) != VERSION:
+            special_error(f"{file_name} is an image of version {version}", f"expected version {VERSION}, the image has to be made again")
+
+        if file.read(32) != grammar_hash(grammar):
+            special_error(f"{file_name} was made with a different grammar", f"the image has to be made again")
+
+        vars, macros = pickle.load(file)
+
+    compiler.global_frame.vars.update(vars)
+    compiler.macros.update(macros)
@@ -0,0 +1,71 @@
+from error import error, special_error
+from my_ast import Node
+import time
+import sys
+
+try:
+    import resource
+except ImportError: # not on windows
+    resource = None
+
+EXIT_CODE = 3 # exit code when a limit is reached, so its not mistaken for a normal error
+CHECK_EVERY = 1024 # instructions between checks of the time and memory limits
+FRAMES_PER_CALL = 32 # python frames allowed for every ember call when --max-depth raises the recursion limit
+
+max_instructions: int | None = None
+max_depth: int | None = None
+max_time: float | None = None # seconds
+max_memory: int | None = None # bytes, compared with how much the peak resident memory grew since init
+
+executed = 0
+pending = 1 # instructions until the next check, compiler.compile counts these down
+start_time = 0.0
+start_memory = 0
+
+def init(_max_instructions: int | None, _max_depth: int | None, _max_time: float | None, _max_memory: int | None) -> None:
+    global max_instructions, max_depth, max_time, max_memory, start_time, start_memory
+
+    max_instructions = _max_instructions
+    max_depth = _max_depth
+    max_time = _max_time
+    max_memory = _max_memory
+
+    if max_memory != None:
+        if resource == None:
+            special_error(f"--max-memory is not supported on this platform")
+
+        start_memory = memory()
+
+    if max_depth != None: # python would run out of frames before the limit is reached
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), max_depth * FRAMES_PER_CALL + 1000))
+
+    start_time = time.monotonic()
+
+def memory() -> int: # peak resident memory of the process in bytes, cheap enough to read on every check
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss if sys.platform == "darwin" else rss * 1024 # kilobytes everywhere else
+
+def check(node: Node, countdown: int = 0) -> int: # called by compiler.compile when its countdown runs out, returns the next countdown
+    global executed, pending
+
+    executed += pending - countdown # countdown is only left over when checking early, like after $pmap
+
+    if max_instructions != None and executed > max_instructions:
+        error(node, f"instruction limit reached", f"ran more than {max_instructions} instructions", exit_code = EXIT_CODE)
+
+    if max_time != None and time.monotonic() - start_time > max_time:
+        error(node, f"time limit reached", f"ran for more than {max_time} seconds", exit_code = EXIT_CODE)
+
+    if max_memory != None and memory() - start_memory > max_memory:
+        error(node, f"memory limit reached", f"using more than {max_memory} bytes", exit_code = EXIT_CODE)
+
+    pending = CHECK_EVERY
+    if max_instructions != None:
+        pending = min(pending, max_instructions + 1 - executed)
+
+    return pending
+
+def check_depth(node: Node, depth: int) -> None:
+    if max_depth != None and depth > max_depth:
+        error(node, f"call depth limit reached", f"calls nested more than {max_depth} deep", exit_code = EXIT_CODE)
@@ -3,9 +3,15 @@
 from lark import Lark
 import my_ast as ast
 import argparse
+import checker
 import compiler
 import emitter
 import error
+import image
+import peephole
+import limits
+import memory
+import reader
 
 SYNTAX_FILE = "syntax.lark"
 
@@ -29,21 +35,87 @@ parser.add_argument(
     "-p", "--parse", action="store_true",
     help="parse and exit without compiling"
 )
+parser.add_argument(
+    "--max-instructions", type=int, default=None,
+    help="abort after running this many instructions"
+)
+parser.add_argument(
+    "--max-depth", type=int, default=None,
+    help="abort when function calls nest deeper than this"
+)
+parser.add_argument(
+    "--max-time", type=float, default=None,
+    help="abort after running for this many seconds"
+)
+parser.add_argument(
+    "--max-memory", type=float, default=None,
+    help="abort when the peak memory grows by more than this many megabytes"
+)
+parser.add_argument(
+    "--peephole", action="append", default=[], metavar="RULES",
+    help="python file with peephole rules to run on the output"
+)
+parser.add_argument(
+    "--image", default=None,
+    help="load the interpreter state from an image before compiling"
+)
+parser.add_argument(
+    "--dump-image", default=None, metavar="IMAGE",
+    help="save the interpreter state to an image after compiling"
+)
+parser.add_argument(
+    "--mem-report", default=None, metavar="JSON",
+    help="report the memory used by every top level form and save it as json"
+)
 args = parser.parse_args()
 
-# parse(using lark)
-parser = Lark(open(SYNTAX_FILE, "r").read(), parser="lalr")
-tree = parser.parse(open(args.input, "r").read())
+# parse(using lark) and compile one top level form at a time
+grammar = open(SYNTAX_FILE, "r").read()
+parser = Lark(grammar, parser="lalr", start="expr")
 
-if args.parse:
-    print(tree.pretty())
+error.init(args.input, reader.line_offsets)
+if not(args.parse):
+    for rules in args.peephole:
+        peephole.load(rules)
 
-node = ast.transform(tree).make_main()
-if args.debug:
-    print(node)
+    if args.image != None:
+        image.load(args.image, grammar)
 
-if not(args.parse):
-    error.init(args.input, open(args.input, "r").read().split("\n"))
     emitter.init(args.output)
-    compiler.compile(node)
-    emitter.exit()
\ No newline at end of file
+
+    if args.mem_report != None:
+        memory.init()
+    limits.init(
+        args.max_instructions, args.max_depth, args.max_time,
+        None if args.max_memory == None else int(args.max_memory * 1024 * 1024)
+    )
+
+for tree in reader.read(args.input, parser):
+    if args.parse:
+        print(tree.pretty())
+
+    node = ast.transform_expr(tree)
+    if args.debug:
+        print(node)
+
+    if not(args.parse):
+        checker.check_form(node)
+
+        if args.mem_report != None:
+            memory.begin()
+            compiler.compile(node)
+            memory.end(node)
+        else:
+            compiler.compile(node)
+
+    del tree, node # release the form before reading the next one
+
+if not(args.parse):
+    emitter.exit()
+    peephole.report()
+
+    if args.dump_image != None:
+        image.dump(args.dump_image, grammar)
+
+    if args.mem_report != None:
+        memory.report(args.mem_report)
\ No newline at end of file
@@ -0,0 +1,118 @@
+import my_ast as ast
+import tracemalloc
+import compiler
+import error
+import json
+import sys
+import gc
+
+# --mem-report, measures the memory of every top level form and counts what is still alive at the end
+
+forms: list[dict] = []
+start = 0
+traced_peak = 0 # highest total traced memory over every form, unlike the per form peaks it isnt relative to a start
+
+def init() -> None:
+    tracemalloc.start()
+
+def name(node: ast.Node | ast.Unit) -> tuple[int | None, int | None, str]:
+    if type(node) == ast.Unit:
+        token = None if node.position == None else node
+    else:
+        token = node.source()
+
+    if type(node) == ast.Unit:
+        text = node.value
+    elif len(node) >= 1 and type(node[0]) == ast.Unit:
+        text = f"({node[0].value} ...)"
+    else:
+        text = "(...)"
+
+    if token == None:
+        return None, None, text
+    return token.line, token.column, text
+
+def begin() -> None:
+    global start
+
+    start = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+
+def end(node: ast.Node | ast.Unit) -> None:
+    global traced_peak
+
+    current, form_peak = tracemalloc.get_traced_memory()
+    traced_peak = max(traced_peak, form_peak)
+    line, column, text = name(node)
+
+    forms.append({
+        "line": line,
+        "column": column,
+        "form": text,
+        "delta": current - start,
+        "peak": form_peak - start,
+    })
+
+def size(x: object) -> int:
+    total = sys.getsizeof(x)
+
+    if hasattr(x, "__dict__"):
+        total += sys.getsizeof(x.__dict__)
+
+    return total
+
+def census() -> dict:
+    values = {}
+    objects = {"Node": {"count": 0, "bytes": 0}, "Unit": {"count": 0, "bytes": 0}}
+
+    for x in gc.get_objects():
+        match type(x):
+            case compiler.Value:
+                entry = values.setdefault(x.type, {"count": 0, "bytes": 0})
+                entry["count"] += 1
+                entry["bytes"] += size(x) + (0 if x.type == "func" else sys.getsizeof(x.value)) # list items are counted as their own values
+
+            case ast.Node:
+                objects["Node"]["count"] += 1
+                objects["Node"]["bytes"] += size(x) + sys.getsizeof(x.children)
+
+            case ast.Unit:
+                objects["Unit"]["count"] += 1
+                objects["Unit"]["bytes"] += size(x) + sys.getsizeof(x.value)
+
+    return {
+        "values": values,
+        "objects": objects,
+        "macro_expansions": compiler.expansions,
+        "error_elements": len(error.errors),
+        "traced_peak": traced_peak,
+    }
+
+def report(file_name: str) -> None:
+    data = {"forms": forms} | census()
+
+    with open(file_name, "w") as file:
+        json.dump(data, file, indent=4)
+
+    def table(header: list[str], rows: list[list]) -> None:
+        rows = [[str(x) for x in row] for row in rows]
+        widths = [max([len(h)] + [len(row[i]) for row in rows]) for i, h in enumerate(header)]
+
+        print(" | ".join(h.ljust(w) for h, w in zip(header, widths)), file=sys.stderr)
+        print("-+-".join("-" * w for w in widths), file=sys.stderr)
+        for row in rows:
+            print(" | ".join(x.ljust(w) for x, w in zip(row, widths)), file=sys.stderr)
+        print(file=sys.stderr)
+
+    table(["at", "form", "delta", "peak above start"], [
+        ["?" if f["line"] == None else f"{f['line']}:{f['column']}", f["form"], f["delta"], f["peak"]] for f in forms
+    ])
+    table(["live", "count", "bytes"],
+        [[f"value {t}", x["count"], x["bytes"]] for t, x in data["values"].items()] +
+        [[t, x["count"], x["bytes"]] for t, x in data["objects"].items()]
+    )
+    table(["other", "count"], [
+        ["macro expansions", data["macro_expansions"]],
+        ["error elements", data["error_elements"]],
+        ["traced peak bytes", data["traced_peak"]],
+    ])
@@ -1,25 +1,64 @@
 from typing_extensions import Self
+from typing import Iterator
 import lark
+import sys
+
+COLUMN_BITS = 24 # columns are packed into position next to the line
+
+def pack(line: int, column: int, end_column: int) -> int | None:
+    if column >= 1 << COLUMN_BITS or end_column >= 1 << COLUMN_BITS: # would spill into the other fields, the unit is left without a position
+        return None
+
+    return (line << (2 * COLUMN_BITS)) | (column << COLUMN_BITS) | end_column
 
 class Unit:
-    def __init__(self, source: lark.Token, value: str):
-        self.source = source
+    __slots__ = ("position", "value")
+
+    def __init__(self, position: int | None, value: str):
+        self.position = position # line, column and end column packed by pack(), None if it doesnt come from the source
         self.value = value
 
+    @property
+    def line(self) -> int:
+        return self.position >> (2 * COLUMN_BITS)
+
+    @property
+    def column(self) -> int:
+        return (self.position >> COLUMN_BITS) & ((1 << COLUMN_BITS) - 1)
+
+    @property
+    def end_column(self) -> int:
+        return self.position & ((1 << COLUMN_BITS) - 1)
+
     def __repr__(self) -> str:
-        return f"\"{self.value}\" from <{self.source}> at {self.source.line}:{self.source.column}"
+        if self.position == None:
+            return f"\"{self.value}\""
+
+        return f"\"{self.value}\" at {self.line}:{self.column}"
 
 class Node:
-    def __init__(self, children: "list[Node | Unit]" = None):
-        self.children = children or []
-        self.main = False
+    __slots__ = ("children", "synthetic", "checked")
+
+    def __init__(self, children: "tuple[Node | Unit, ...] | list[Node | Unit]" = (), synthetic: bool = False):
+        self.children = tuple(children)
+        self.synthetic = synthetic # made by a macro expansion, its positions dont point at the code being run
+        self.checked = False # set by checker.py when the argument types are already known to be right
+
+    def make_synthetic(self) -> Self:
+        if not self.synthetic: # already marked subtrees are skipped, so this is only paid once per node
+            self.synthetic = True
+
+            for x in self.children:
+                if type(x) == Node:
+                    x.make_synthetic()
 
-    def make_main(self) -> Self:
-        self.main = True
         return self
 
-    def append(self, item: "Node | Unit") -> None:
-        self.children.append(item)
+    def source(self) -> Unit | None: # the unit errors point at
+        if self.synthetic or len(self.children) == 0 or type(self.children[0]) != Unit or self.children[0].position == None:
+            return None
+
+        return self.children[0]
 
     def get_repr(self) -> str:
         thru = "├"
@@ -55,16 +94,8 @@ class Node:
 
         return new_make_elems()
 
-    def __iter__(self) -> Self:
-        self.count = 0
-        return self
-
-    def __next__(self) -> "Node | Unit":
-        if self.count != len(self):
-            self.count += 1
-            return self[self.count - 1]
-        else:
-            raise StopIteration
+    def __iter__(self) -> "Iterator[Node | Unit]": # nodes are shared between macro expansions, so this has to be re-entrant
+        return iter(self.children)
 
     def __getitem__(self, index: int) -> "Node | Unit":
         if type(index) != int:
@@ -78,20 +109,18 @@ class Node:
     def __repr__(self) -> str:
         return "node\n" + "\n".join(self.get_repr())
 
-def transform(tree: lark.Tree) -> Node:
-    node = Node()
-
-    for item in tree.children:
-        match item.data:
-            case "atom":
-                tok = item.children[0]
-                node.append(Unit(tok, tok.value))
+def transform_expr(item: lark.Tree) -> Node | Unit:
+    match item.data:
+        case "atom":
+            tok = item.children[0]
+            return Unit(pack(tok.line, tok.column, tok.end_column), sys.intern(tok.value))
 
-            case "str":
-                tok = item.children[0]
-                node.append(Unit(tok, tok.value[1:-1]))
+        case "str":
+            tok = item.children[0]
+            return Unit(pack(tok.line, tok.column, tok.end_column), tok.value[1:-1])
 
-            case "expr":
-                node.append(transform(item))
+        case "expr":
+            return transform(item)
 
-    return node
+def transform(tree: lark.Tree) -> Node:
+    return Node([transform_expr(item) for item in tree.children])
@@ -0,0 +1,129 @@
+from error import special_error
+from typing import Callable
+import runpy
+import sys
+import re
+
+# optional stage between compiler.py and emitter.py, only used once a rule is registered
+# emitted lines are kept in a window and rules rewrite the end of it before the lines get written
+
+WINDOW = 8 # lines kept before writing, grows to fit the largest rule
+MAX_REWRITES = 256 # rewrites allowed after a single line is emitted, rules that keep growing their output would never stop
+
+class Rule:
+    def __init__(self, name: str, size: int, func: Callable[[list[str]], list[str] | None]) -> None:
+        self.name = name
+        self.size = size # number of lines the rule looks at
+        self.func = func # gets the last size lines, returns what to replace them with or None
+
+rules: list[Rule] = []
+fired: dict[str, int] = {}
+window: list[str] = []
+partial = "" # text after the last newline, not a full line yet
+
+def add(rule: Rule) -> None:
+    global WINDOW
+
+    if rule.name in fired:
+        raise Exception(f"peephole rule {rule.name} already exists")
+
+    if rule.size < 1:
+        raise Exception(f"peephole rule {rule.name} has to look at 1 or more lines")
+
+    rules.append(rule)
+    fired[rule.name] = 0
+    WINDOW = max(WINDOW, rule.size)
+
+def rule(name: str, size: int) -> Callable:
+    # decorator for rules written in python:
+    # @peephole.rule("jump-next", 2)
+    # def jump_next(lines: list[str]) -> list[str] | None: ...
+    def decorator(func: Callable[[list[str]], list[str] | None]) -> Callable[[list[str]], list[str] | None]:
+        add(Rule(name, size, func))
+        return func
+
+    return decorator
+
+def pattern(name: str, match: list[str], replace: list[str]) -> None:
+    # rule from lines with {x} wildcards, a wildcard used again has to match the same text
+    seen = []
+
+    def wildcard(m: re.Match) -> str:
+        if m.group(1) in seen:
+            return f"(?P={m.group(1)})"
+
+        seen.append(m.group(1))
+        return f"(?P<{m.group(1)}>.+?)"
+
+    regex = re.compile("\n".join(re.sub(r"\\\{(\w+)\\\}", wildcard, re.escape(x)) for x in match))
+
+    def func(lines: list[str]) -> list[str] | None:
+        if (m := regex.fullmatch("\n".join(lines))) == None:
+            return None
+
+        captures = m.groupdict()
+        return [re.sub(r"\{(\w+)\}", lambda x: captures.get(x.group(1), x.group(0)), x) for x in replace]
+
+    add(Rule(name, len(match), func))
+
+def load(file_name: str) -> None: # runs a python file that registers rules with @peephole.rule
+    runpy.run_path(file_name, {"peephole": sys.modules[__name__]})
+
+def optimize() -> None:
+    changed = True
+    rewrites = 0
+
+    while changed:
+        changed = False
+
+        for r in rules:
+            if len(window) < r.size:
+                continue
+
+            lines = window[-r.size:]
+            new = r.func(lines)
+
+            if new != None and new != lines:
+                window[-r.size:] = new
+                fired[r.name] += 1
+                changed = True
+
+                rewrites += 1
+                if rewrites > MAX_REWRITES:
+                    special_error(f"peephole rule {r.name} rewrote the output more than {MAX_REWRITES} times for a single line", "a rule that makes its own input again never stops")
+
+                break
+
+def emit(string: str, write: Callable[[str], None]) -> None:
+    global partial
+
+    lines = (partial + string).split("\n")
+    partial = lines.pop()
+
+    for line in lines:
+        window.append(line)
+        optimize()
+
+        while len(window) > WINDOW:
+            write(window.pop(0) + "\n")
+
+def flush(write: Callable[[str], None]) -> None:
+    global partial
+
+    for line in window:
+        write(line + "\n")
+    window.clear()
+
+    write(partial)
+    partial = ""
+
+def report() -> None:
+    if len(rules) == 0:
+        return
+
+    width = max(len("rule"), *[len(r.name) for r in rules])
+
+    print(f"{'rule'.ljust(width)} | fired", file=sys.stderr)
+    print(f"{'-' * width}-+-------", file=sys.stderr)
+    for r in rules:
+        print(f"{r.name.ljust(width)} | {fired[r.name]}", file=sys.stderr)
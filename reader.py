@@ -0,0 +1,130 @@
+from error import special_error
+from typing import Iterator
+import lark
+
+line_offsets: list[int] = [] # byte offset of every line read so far, used by error.py to look lines up
+
+def split_forms(file_name: str) -> Iterator[tuple[str, int, int]]: # yields (text, line, column) of every top level form
+    line_offsets.clear()
+
+    pieces = []
+    start = None # (line, column) of the form being read
+    depth = 0
+    quote = None
+    escape = False
+    in_atom = False
+
+    with open(file_name, "rb") as file:
+        offset = 0
+
+        for number, raw in enumerate(file, start = 1):
+            line_offsets.append(offset)
+            offset += len(raw)
+
+            line = raw.decode()
+            begin = 0
+            i = 0
+
+            while i < len(line):
+                c = line[i]
+
+                if start == None:
+                    if c.isspace():
+                        i += 1
+                        continue
+
+                    if c == ";": # comment until the end of the line
+                        break
+
+                    start = (number, i + 1)
+                    begin = i
+
+                if quote != None:
+                    if escape:
+                        escape = False
+                    elif c == "\\":
+                        escape = True
+                    elif c == quote:
+                        quote = None
+                        i += 1
+
+                        if depth == 0:
+                            pieces.append(line[begin:i])
+                            yield "".join(pieces), *start
+                            pieces, start = [], None
+                        continue
+                    elif c == "\n": # unterminated string, let the parser complain about it
+                        quote = None
+
+                        if depth == 0:
+                            pieces.append(line[begin:i])
+                            yield "".join(pieces), *start
+                            pieces, start = [], None
+
+                    i += 1
+                    continue
+
+                if in_atom:
+                    if not(c.isspace() or c in "()[]\"'"):
+                        i += 1
+                        continue
+
+                    in_atom = False
+
+                    if depth == 0:
+                        pieces.append(line[begin:i])
+                        yield "".join(pieces), *start
+                        pieces, start = [], None
+                        continue
+
+                if c == ";":
+                    break
+                elif c in "([":
+                    depth += 1
+                elif c in ")]":
+                    depth -= 1
+
+                    if depth <= 0:
+                        depth = 0
+                        i += 1
+                        pieces.append(line[begin:i])
+                        yield "".join(pieces), *start
+                        pieces, start = [], None
+                        continue
+                elif c in "\"'":
+                    quote = c
+                elif not c.isspace():
+                    in_atom = True
+
+                i += 1
+
+            if start != None:
+                pieces.append(line[begin:])
+
+    if start != None: # unfinished form at the end of the file
+        yield "".join(pieces), *start
+
+def read(file_name: str, parser: lark.Lark) -> Iterator[lark.Tree]: # parses one top level form at a time
+    for text, line, column in split_forms(file_name):
+        try:
+            tree = parser.parse(text)
+        except lark.UnexpectedInput as e:
+            if e.line == -1:
+                e.line, e.column = 1, 1
+
+            if e.line == 1:
+                e.column += column - 1
+
+            special_error(f"failed to parse {file_name}:{e.line + line - 1}:{e.column}", f"in form starting at {line}:{column}")
+
+        # tokens are relative to the form, make them relative to the file
+        for token in tree.scan_values(lambda x: isinstance(x, lark.Token)):
+            if token.line == 1:
+                token.column += column - 1
+            if token.end_line == 1:
+                token.end_column += column - 1
+
+            token.line += line - 1
+            token.end_line += line - 1
+
+        yield tree